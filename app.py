@@ -1,14 +1,21 @@
 import datetime
 import os
 import re
+from urllib.parse import urlsplit
 
 import pymongo
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 from bson.objectid import ObjectId
 from dotenv import load_dotenv
-from flask import Flask, flash, redirect, render_template, request, url_for
-from flask_login import LoginManager, UserMixin, current_user, login_required, login_user, logout_user
-from werkzeug.security import check_password_hash, generate_password_hash
+from flask import Flask, flash, g, redirect, render_template, request, session, url_for
+from flask_caching import Cache
+from flask_compress import Compress
+from flask_login import LoginManager, current_user, login_required, login_user, logout_user
+from werkzeug.exceptions import HTTPException
+from werkzeug.security import check_password_hash
 from pymongo import ASCENDING,DESCENDING
+from pymongo.errors import DuplicateKeyError
 from datetime import timedelta
 try:
     from zoneinfo import ZoneInfo
@@ -30,8 +37,21 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "dev-secret-change-me")
 
-# connect to MongoDB
-client = pymongo.MongoClient(os.getenv("MONGO_URI"))
+# in-process cache for pages that look the same for every visitor
+cache = Cache(app, config={"CACHE_TYPE": "SimpleCache"})
+
+# gzip/brotli the HTML we render, and let browsers keep static files for a day
+Compress(app)
+app.config["SEND_FILE_MAX_AGE_DEFAULT"] = timedelta(days=1)
+
+# connect to MongoDB (one client per process, it keeps a pool of warm connections)
+client = pymongo.MongoClient(
+    os.getenv("MONGO_URI"),
+    maxPoolSize=50,
+    minPoolSize=5,
+    waitQueueTimeoutMS=2000,
+    appname="sips"
+)
 db = client[os.getenv("MONGO_DBNAME", "sips")]
 
 # collections 
@@ -41,9 +61,67 @@ saved_col   = db["saved_places"]
 reviews_col = db["reviews"]
 checkins_col= db["checkins"]
 
+# timezone-aware "now" for stored timestamps (utcnow() is deprecated)
+_datetime_now = datetime.datetime.now
+_UTC = datetime.timezone.utc
+
+def utc_now():
+    return _datetime_now(_UTC)
+
+# turns a URL id into an ObjectId, or None if it isn't one (no exception on bad input)
+def to_object_id(value):
+    return ObjectId(value) if ObjectId.is_valid(value) else None
+
+# home groups cafes by the last word of their address (the zip code)
+def zip_from_address(address):
+    parts = (address or "").split()
+    return parts[-1] if parts else "Other"
+
+# where to send the user after a form post: the page they posted from, unless that page is
+# itself a POST-only URL (a review form re-rendered with errors), then the fallback
+def back_url(fallback):
+    referrer = request.referrer
+    if not referrer:
+        return fallback
+    try:
+        app.url_map.bind_to_environ(request.environ).match(urlsplit(referrer).path, method="GET")
+    except HTTPException:
+        return fallback
+    return referrer
+
+# cafes per page on the home screen, and the furthest page we'll serve
+HOME_PAGE_SIZE = 50
+HOME_MAX_PAGE = 1000
+
+# most recent reviews shown on a cafe page
+CAFE_REVIEWS_LIMIT = 50
+
+# emails are always stored and looked up in this form
+def normalize_email(email):
+    return (email or "").strip().lower()
+
+# indexes used by the hot query paths
+def ensure_indexes():
+    # search matches an anchored prefix on the lowercased name (older cafes: see migrate.py)
+    cafes_col.create_index("name_lower")
+    # home pages through cafes by zip, then name (older cafes: see migrate.py)
+    cafes_col.create_index([("zip_code", ASCENDING), ("name", ASCENDING)])
+    cafes_col.create_index(
+        [("name", "text"), ("description", "text")],
+        weights={"name": 10, "description": 3}
+    )
+    # login/signup lookups and the reviews on a cafe page
+    # emails are stored normalized, so a plain index (no collation) is enough (older users: see migrate.py)
+    users_col.create_index("email", unique=True)
+    users_col.create_index("username", unique=True)
+    # cafe_id + newest first covers the cafe page's filter and sort
+    reviews_col.create_index([("cafe_id", ASCENDING), ("created_at", DESCENDING)])
+
+ensure_indexes()
+
 #Helper to update ratings
 def update_cafe_rating(cafe_id):
-    reviews=list(reviews_col.find({"cafe_id": cafe_id}))
+    reviews=list(reviews_col.find({"cafe_id": cafe_id}, {"rating": 1}))
 
     if not reviews:
         cafes_col.update_one(
@@ -57,6 +135,27 @@ def update_cafe_rating(cafe_id):
         {"_id": cafe_id},
         {"$set": {"rating": average}}
     )
+#Helper to check a login password, moving old werkzeug hashes over to argon2
+password_hasher = PasswordHasher()
+
+def verify_password(user_doc, password):
+    stored = user_doc.get("password_hash", "")
+    if stored.startswith("$argon2"):
+        try:
+            password_hasher.verify(stored, password)
+        except (VerificationError, InvalidHashError):
+            return False
+        if not password_hasher.check_needs_rehash(stored):
+            return True
+    elif not check_password_hash(stored, password):
+        return False
+
+    users_col.update_one(
+        {"_id": user_doc["_id"]},
+        {"$set": {"password_hash": password_hasher.hash(password)}}
+    )
+    return True
+
 #Helper function to extract times 
 def hours_list_from_range(hours_str):
     parts= re.split(r"\s*[–—-]\s*",hours_str.strip())
@@ -86,40 +185,69 @@ login_manager.login_message = "Please log in to access that page."
 login_manager.login_message_category = "info"
 
 
-# represents the logged-in user
-class User(UserMixin):
+# represents the logged-in user (only the fields templates use, never the password hash)
+# (no UserMixin: it has no __slots__, so instances would still carry a __dict__)
+class User:
+    __slots__ = ("id", "username", "email", "role")
+
+    # what flask-login expects from a logged-in user
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
     def __init__(self, user_doc):
-        self.user_doc = user_doc
+        self.id = str(user_doc["_id"])
+        self.username = user_doc.get("username", "")
+        self.email = user_doc.get("email", "")
+        self.role = user_doc.get("role", "customer")
 
-    # returns the user's id from MongoDB
     def get_id(self):
-        return str(self.user_doc["_id"])
+        return self.id
 
-    @property
-    def username(self):
-        return self.user_doc.get("username", "")
 
-    @property
-    def email(self):
-        return self.user_doc.get("email", "")
-    
-    @property
-    def role(self):
-        return self.user_doc.get("role", "customer")
+# keeps the fields we read off current_user in the session
+def cache_user(user_doc):
+    session["user_json"] = {
+        "_id": str(user_doc["_id"]),
+        "username": user_doc.get("username", ""),
+        "email": user_doc.get("email", ""),
+        "role": user_doc.get("role")
+    }
 
 
 # called on every request to get the current user from the session
 @login_manager.user_loader
 def load_user(user_id):
-    try:
-        doc = users_col.find_one({"_id": ObjectId(user_id)})
-    except Exception:
+    cached = session.get("user_json")
+    if cached and cached.get("_id") == user_id:
+        return User(cached)
+
+    # cache miss, fall back to the database
+    user_oid = to_object_id(user_id)
+    if not user_oid:
         return None
-    return User(doc) if doc else None
+    doc = users_col.find_one(
+        {"_id": user_oid},
+        {"username": 1, "email": 1, "role": 1}
+    )
+    if not doc:
+        return None
+    cache_user(doc)
+    return User(doc)
+
+
+# parse the logged-in user's id once per request for the routes below
+@app.before_request
+def load_user_ids():
+    if current_user.is_authenticated:
+        g.user_oid = ObjectId(current_user.get_id())
+        g.user_id_str = current_user.get_id()
 
 
 # --- Splash screen ---
 @app.route("/")
+# same page for every logged-out visitor, unless there's a flash message to show
+@cache.cached(timeout=3600, unless=lambda: current_user.is_authenticated or "_flashes" in session)
 def index():
     """
     Route for the index page
@@ -144,7 +272,7 @@ def signup():
     
     if request.method == "POST":
         username = request.form.get("username", "").strip()
-        email    = request.form.get("email", "").strip().lower()
+        email    = normalize_email(request.form.get("email"))
         password = request.form.get("password", "")
 
         error = None
@@ -156,10 +284,6 @@ def signup():
             error = "Password is required."
         elif len(password) < 6:
             error = "Password must be at least 6 characters."
-        elif users_col.find_one({"email": email}):
-            error = "An account with that email already exists."
-        elif users_col.find_one({"username": username}):
-            error = "That username is already taken."
 
         if error:
             flash(error, "error")
@@ -169,15 +293,26 @@ def signup():
         new_user = {
             "username": username,
             "email": email,
-            "password_hash": generate_password_hash(password),
-            "created_at": datetime.datetime.utcnow(),
+            "password_hash": password_hasher.hash(password),
+            "created_at": utc_now(),
             "role": None
         }
-        result = users_col.insert_one(new_user)
+        # the unique indexes reject taken emails/usernames, no need to look them up first
+        try:
+            result = users_col.insert_one(new_user)
+        except DuplicateKeyError as e:
+            # keyPattern names the clashing field (older servers only put the index name in errmsg)
+            details = e.details or {}
+            if "email" in details.get("keyPattern", {}) or "email_1" in details.get("errmsg", ""):
+                flash("An account with that email already exists.", "error")
+            else:
+                flash("That username is already taken.", "error")
+            return render_template("signup.html", username=username, email=email)
         new_user["_id"] = result.inserted_id
 
         # log in right after signing up
         login_user(User(new_user))
+        cache_user(new_user)
         flash(f"Welcome to Sips, {username}!", "success")
         return redirect(url_for("select_role"))
     
@@ -193,27 +328,35 @@ def select_role():
     if request.method == "POST":
         role = request.form.get("role")
 
-        if role in ["customer", "owner"]:
-            users_col.update_one(
-                {"_id": ObjectId(current_user.get_id())}, 
+        if role in {"customer", "owner"}:
+            # only set the role once, a second POST can't overwrite it
+            result = users_col.update_one(
+                {"_id": g.user_oid, "role": None},
                 {"$set": {"role": role}}
             )
+            if not result.matched_count:
+                flash("Your account type has already been set.", "info")
+                return redirect(url_for("home"))
+
             if role == "owner":
             
-                existing_cafe = cafes_col.find_one({"owner_id": ObjectId(current_user.get_id())})
+                existing_cafe = cafes_col.find_one({"owner_id": g.user_oid})
                 if not existing_cafe:
                     new_cafe = {
-                        "owner_id": ObjectId(current_user.get_id()), 
+                        "owner_id": g.user_oid, 
                         "name": "My New Cafe", 
+                        "name_lower": "my new cafe",
                         "address": "Please update your address",
+                        "zip_code": zip_from_address("Please update your address"),
                         "price_range": "$$",
                         "hours": {day: "Closed" for day in ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']},
                         "amenities": [],
                         "popular": [],
                         "photos": [],
-                        "created_at": datetime.datetime.utcnow()
+                        "created_at": utc_now()
                     }
                     cafes_col.insert_one(new_cafe)
+            session.pop("user_json", None)
             flash(f"Account set up as {role.capitalize()}!", "success")
 
             if role == "owner":
@@ -234,17 +377,18 @@ def login():
         return redirect(url_for("home"))
 
     if request.method == "POST":
-        email    = request.form.get("email", "").strip().lower()
+        email    = normalize_email(request.form.get("email"))
         password = request.form.get("password", "")
 
         user_doc = users_col.find_one({"email": email})
 
         # one generic error 
-        if not user_doc or not check_password_hash(user_doc["password_hash"], password):
+        if not user_doc or not verify_password(user_doc, password):
             flash("Invalid email or password.", "error")
             return render_template("login.html", email=email)
 
         login_user(User(user_doc))
+        cache_user(user_doc)
         flash(f"Welcome back, {user_doc['username']}!", "success")
 
         # send user back to the page 
@@ -259,6 +403,7 @@ def login():
 @login_required
 def logout():
     logout_user()
+    session.pop("user_json", None)
     flash("You've been logged out.", "info")
     return redirect(url_for("index"))
 
@@ -268,27 +413,41 @@ def logout():
 @app.route("/home")
 @login_required
 def home():
-    cafes = list(cafes_col.find())
+    # clamped so skip() stays small (huge page numbers would overflow it)
+    page = min(max(request.args.get("page", 0, type=int), 0), HOME_MAX_PAGE)
+
+    # only what the cafe cards show, one page at a time (one extra to know if there's a next page);
+    # sorted by zip so each zip's cafes are consecutive and stay under one heading
+    cafes = list(
+        cafes_col.find({}, {"name": 1, "address": 1, "zip_code": 1, "photos": {"$slice": 1}})
+        .sort([("zip_code", ASCENDING), ("name", ASCENDING)])
+        .skip(page * HOME_PAGE_SIZE)
+        .limit(HOME_PAGE_SIZE + 1)
+    )
+    has_next = len(cafes) > HOME_PAGE_SIZE and page < HOME_MAX_PAGE
+    cafes = cafes[:HOME_PAGE_SIZE]
 
     selected_cafe = None
     selected_id = request.args.get("selected")
 
-    if selected_id:
-        try:
-            selected_cafe = cafes_col.find_one({"_id": ObjectId(selected_id)})
-        except Exception:
-            selected_cafe = None
+    selected_oid = to_object_id(selected_id)
+    if selected_oid:
+        selected_cafe = cafes_col.find_one({"_id": selected_oid})
 
     grouped = {}
     for cafe in cafes:
-        address = cafe.get("address", "")
-        parts = address.split()
-        zip_code = parts[-1] if parts else "Other"
+        zip_code = cafe.get("zip_code") or zip_from_address(cafe.get("address"))
         if zip_code not in grouped:
             grouped[zip_code] = []
         grouped[zip_code].append(cafe)
 
-    return render_template("home.html", grouped=grouped, selected_cafe=selected_cafe)
+    return render_template(
+        "home.html",
+        grouped=grouped,
+        selected_cafe=selected_cafe,
+        page=page,
+        has_next=has_next
+    )
 
 
 @app.route("/search", methods=["GET"])
@@ -305,10 +464,6 @@ def search():
 
     filters = {}
 
-    #normal search 
-    if query:
-        filters["name"] = {"$regex": query, "$options": "i"}
-
     # rating filter 
     if min_rating:
         filters["rating"] = {"$gte": float(min_rating)}
@@ -317,23 +472,39 @@ def search():
     if price:
         filters["price_range"] = price
 
-    cafes_query = db.cafes.find(filters)
-
-    # sort
-    if sort_by == "rating_desc":
-        cafes_query = cafes_query.sort("rating", DESCENDING)
-    elif sort_by == "rating_asc":
-        cafes_query = cafes_query.sort("rating", ASCENDING)
-    elif sort_by == "name_asc":
-        cafes_query = cafes_query.sort("name", ASCENDING)
-    elif sort_by == "name_desc":
-        cafes_query = cafes_query.sort("name", DESCENDING)
-    elif sort_by == "price_asc":
-        cafes_query = cafes_query.sort("price_range", ASCENDING)
-    elif sort_by == "price_desc":
-        cafes_query = cafes_query.sort("price_range", DESCENDING)
-
-    cafes = list(cafes_query)
+    def run_search(match, projection=None):
+        cafes_query = cafes_col.find(match, projection)
+
+        # sort
+        if sort_by == "rating_desc":
+            cafes_query = cafes_query.sort("rating", DESCENDING)
+        elif sort_by == "rating_asc":
+            cafes_query = cafes_query.sort("rating", ASCENDING)
+        elif sort_by == "name_asc":
+            cafes_query = cafes_query.sort("name", ASCENDING)
+        elif sort_by == "name_desc":
+            cafes_query = cafes_query.sort("name", DESCENDING)
+        elif sort_by == "price_asc":
+            cafes_query = cafes_query.sort("price_range", ASCENDING)
+        elif sort_by == "price_desc":
+            cafes_query = cafes_query.sort("price_range", DESCENDING)
+        elif projection:
+            cafes_query = cafes_query.sort([("score", {"$meta": "textScore"})])
+
+        return list(cafes_query)
+
+    query = (query or "").strip()
+    if query:
+        # text index first, best matches on top
+        cafes = run_search(
+            {**filters, "$text": {"$search": query}},
+            {"score": {"$meta": "textScore"}}
+        )
+        # fall back to a name prefix match (e.g. partial words)
+        if not cafes:
+            cafes = run_search({**filters, "name_lower": {"$regex": f"^{re.escape(query.lower())}"}})
+    else:
+        cafes = run_search(filters)
 
     return render_template("search.html", cafes=cafes, today_weekday=today_weekday)
 
@@ -341,17 +512,22 @@ def search():
 @app.route("/cafe/<cafe_id>")
 @login_required
 def cafe_detail(cafe_id):
-    try: 
-        cafe= cafes_col.find_one({"_id": ObjectId(cafe_id)})
-    except Exception:
+    cafe_obj_id= to_object_id(cafe_id)
+    if not cafe_obj_id:
         flash("Invalid cafe link.", "error")
         return redirect(url_for("home"))
 
+    cafe= cafes_col.find_one({"_id": cafe_obj_id})
     if not cafe:
         flash("Cafe not found.", "error")
         return redirect(url_for("home"))
     
-    since= datetime.datetime.utcnow() - timedelta(days=30)
+    return render_cafe_detail(cafe)
+
+# builds the cafe page; a review form that failed validation is rendered straight back with its
+# errors and values (no redirect, so the page isn't loaded twice and nothing goes in the session)
+def render_cafe_detail(cafe, errors=None, form=None, editing_id=None):
+    since= utc_now() - timedelta(days=30)
     checkins= list(checkins_col.find({
         "cafe_id": cafe["_id"],
         "created_at": {"$gte": since}
@@ -382,29 +558,57 @@ def cafe_detail(cafe_id):
     peak_times= [{"hour": hr, "count": hour_counts.get(hr, 0)} for hr in hours]
     max_count= max((p["count"] for p in peak_times), default=0)
 
-    reviews= list(reviews_col.find({"cafe_id": cafe["_id"]}))
-    for r in reviews:
-        r["user_id_str"]= str(r.get("user_id"))
-    current_user_id= str(current_user.get_id())
+    reviews= list(
+        reviews_col.find(
+            {"cafe_id": cafe["_id"]},
+            {"rating": 1, "text": 1, "username": 1, "user_id_str": 1, "created_at": 1}
+        )
+        .sort("created_at", DESCENDING)
+        .limit(CAFE_REVIEWS_LIMIT)
+    )
+    review_count= reviews_col.count_documents({"cafe_id": cafe["_id"]})
+    current_user_id= g.user_id_str
 
     return render_template(
         "indiv-cafe-screen.html",
         cafe=cafe,
         reviews=reviews,
+        review_count=review_count,
         current_user_id=current_user_id,
         peak_times=peak_times,
         max_count=max_count,
         hours=hours,
-        today_weekday=today_weekday
+        today_weekday=today_weekday,
+        errors=errors or [],
+        form=form or {},
+        editing_id=editing_id
     )
 
+#Checks a review form, collecting every problem at once
+def validate_review_form(form):
+    rating_str= form.get("rating", "").strip()
+    text= form.get("text", "").strip()
+    errors= []
+
+    rating= None
+    if not rating_str.isdigit():
+        errors.append("Rating must be a number from 1 to 5.")
+    else:
+        rating= int(rating_str)
+        if rating < 1 or rating > 5:
+            errors.append("Rating must be between 1 and 5.")
+
+    if not text:
+        errors.append("Review text cannot be empty.")
+
+    return rating, text, errors
+
 #Posting reviews
 @app.route("/cafe/<cafe_id>/review", methods=["POST"])
 @login_required
 def add_review(cafe_id):
-    try:
-        cafe_obj_id= ObjectId(cafe_id)
-    except Exception:
+    cafe_obj_id= to_object_id(cafe_id)
+    if not cafe_obj_id:
         flash("Invalid cafe link.","error")
         return redirect(url_for("home"))
 
@@ -413,40 +617,31 @@ def add_review(cafe_id):
         flash("Cafe not found.", "error")
         return redirect(url_for("home"))
 
-    rating_str= request.form.get("rating", "").strip()
-    text= request.form.get("text", "").strip()
-
-    if not rating_str.isdigit():
-        flash("Rating must be a number from 1 to 5.", "error")
-        return redirect(url_for("cafe_detail", cafe_id=cafe_id))
+    rating, text, errors= validate_review_form(request.form)
+    if errors:
+        return render_cafe_detail(cafe, errors=errors, form=request.form), 400
 
-    rating = int(rating_str)
-    if rating < 1 or rating > 5:
-        flash("Rating must be between 1 and 5.", "error")
-        return redirect(url_for("cafe_detail", cafe_id=cafe_id))
-
-    if not text:
-        flash("Review text cannot be empty.", "error")
-        return redirect(url_for("cafe_detail", cafe_id=cafe_id))
+    # the session's copy of the user can be stale (renamed from another session), so read the name fresh
+    author= users_col.find_one({"_id": g.user_oid}, {"username": 1}) or {}
 
     reviews_col.insert_one({
         "cafe_id": cafe_obj_id,
-        "user_id": ObjectId(current_user.get_id()),
-        "username": current_user.username,
+        "user_id": g.user_oid,
+        "user_id_str": g.user_id_str,
+        "username": author.get("username", ""),
         "rating": rating,
         "text": text,
-        "created_at": datetime.datetime.utcnow()
+        "created_at": utc_now()
     })
     update_cafe_rating(cafe_obj_id)
-    return redirect(url_for("cafe_detail", cafe_id=cafe_id))
+    return redirect(url_for("cafe_detail", cafe_id=cafe_id), code=303)
 
 #Deleting reviews 
 @app.route("/review/<review_id>/delete", methods=["POST"])
 @login_required
 def delete_review(review_id):
-    try:
-        rid= ObjectId(review_id)
-    except Exception:
+    rid= to_object_id(review_id)
+    if not rid:
         flash("Invalid review.", "error")
         return redirect(url_for("home"))
 
@@ -456,7 +651,7 @@ def delete_review(review_id):
         return redirect(url_for("home"))
 
     # Only author can delete
-    if str(review.get("user_id")) != str(current_user.get_id()):
+    if review.get("user_id") != g.user_oid:
         flash("You can only delete your own review.", "error")
         return redirect(url_for("cafe_detail", cafe_id=str(review["cafe_id"])))
 
@@ -464,16 +659,15 @@ def delete_review(review_id):
     update_cafe_rating(review["cafe_id"])
     flash("Review deleted successfully.", "success")
     # takes user back to their previous screen(my reviews) or the cafe screen
-    next_url = request.referrer or url_for("cafe_detail", cafe_id=str(review["cafe_id"]))
+    next_url = back_url(url_for("cafe_detail", cafe_id=str(review["cafe_id"])))
     return redirect(next_url)
 
 #Edit reviews 
 @app.route("/review/<review_id>/edit", methods=["POST"])
 @login_required
 def edit_review(review_id):
-    try:
-        rid= ObjectId(review_id)
-    except Exception:
+    rid= to_object_id(review_id)
+    if not rid:
         flash("Invalid review.", "error")
         return redirect(url_for("home"))
 
@@ -483,25 +677,18 @@ def edit_review(review_id):
         return redirect(url_for("home"))
 
     #Only author can make edits
-    if str(review.get("user_id"))!= str(current_user.get_id()):
+    if review.get("user_id")!= g.user_oid:
         flash("You can only edit your own review.", "error")
         return redirect(url_for("cafe_detail", cafe_id=str(review["cafe_id"])))
 
     #Get new values 
-    rating_str= request.form.get("rating", "").strip()
-    text= request.form.get("text", "").strip()
-
-    # Validate rating
-    if not rating_str.isdigit():
-        flash("Rating must be a number 1–5.", "error")
-        return redirect(url_for("cafe_detail", cafe_id=str(review["cafe_id"])))
-    rating = int(rating_str)
-    if rating < 1 or rating > 5:
-        flash("Rating must be between 1 and 5.", "error")
-        return redirect(url_for("cafe_detail", cafe_id=str(review["cafe_id"])))
-    if not text:
-        flash("Review text cannot be empty.", "error")
-        return redirect(url_for("cafe_detail", cafe_id=str(review["cafe_id"])))
+    rating, text, errors= validate_review_form(request.form)
+    if errors:
+        cafe= cafes_col.find_one({"_id": review["cafe_id"]})
+        if not cafe:
+            flash("Cafe not found.", "error")
+            return redirect(url_for("home"))
+        return render_cafe_detail(cafe, errors=errors, form=request.form, editing_id=review_id), 400
 
     # Update 
     reviews_col.update_one(
@@ -511,16 +698,15 @@ def edit_review(review_id):
     update_cafe_rating(review["cafe_id"])
     flash("Review updated successfully.", "success")
     # takes user back to their previous screen(my reviews) or the cafe screen
-    next_url = request.referrer or url_for("cafe_detail", cafe_id=str(review["cafe_id"]))
-    return redirect(next_url)
+    next_url = back_url(url_for("cafe_detail", cafe_id=str(review["cafe_id"])))
+    return redirect(next_url, code=303)
 
 #Add photos
 @app.route("/cafe/<cafe_id>/photo_url", methods=["POST"])
 @login_required
 def add_photo_url(cafe_id):
-    try:
-        cafe_obj_id= ObjectId(cafe_id)
-    except Exception:
+    cafe_obj_id= to_object_id(cafe_id)
+    if not cafe_obj_id:
         flash("Invalid cafe link.", "error")
         return redirect(url_for("home"))
     # read & validate input
@@ -537,7 +723,7 @@ def add_photo_url(cafe_id):
     #     "_id": ObjectId(),
     #     "url": photo_url,
     #     "user_id": ObjectId(current_user.get_id()),
-    #     "created_at": datetime.datetime.utcnow()
+    #     "created_at": utc_now()
     # }
     cafes_col.update_one(
         {"_id": cafe_obj_id},
@@ -550,10 +736,9 @@ def add_photo_url(cafe_id):
 @app.route("/cafe/<cafe_id>/photo/<photo_id>/delete", methods=["POST"])
 @login_required
 def delete_photo(cafe_id, photo_id):
-    try:
-        cafe_obj_id = ObjectId(cafe_id)
-        photo_obj_id = ObjectId(photo_id)
-    except Exception:
+    cafe_obj_id = to_object_id(cafe_id)
+    photo_obj_id = to_object_id(photo_id)
+    if not cafe_obj_id or not photo_obj_id:
         flash("Invalid link.", "error")
         return redirect(url_for("home"))
 
@@ -566,7 +751,7 @@ def delete_photo(cafe_id, photo_id):
             photo= p
             break
     # permission check
-    if str(photo.get("user_id")) != str(current_user.get_id()):
+    if str(photo.get("user_id")) != g.user_id_str:
         flash("You can only delete photos you uploaded.", "error")
         return redirect(url_for("cafe_detail", cafe_id=cafe_id))
     # remove it
@@ -580,9 +765,8 @@ def delete_photo(cafe_id, photo_id):
 @app.route("/cafe/<cafe_id>/checkin", methods=["POST"])
 @login_required
 def add_checkin(cafe_id):
-    try:
-        cafe_obj_id = ObjectId(cafe_id)
-    except Exception:
+    cafe_obj_id = to_object_id(cafe_id)
+    if not cafe_obj_id:
         flash("Invalid cafe link.", "error")
         return redirect(url_for("home"))
     
@@ -597,7 +781,7 @@ def add_checkin(cafe_id):
 
     checkins_col.insert_one({
         "cafe_id": cafe_obj_id,
-        "user_id": ObjectId(current_user.get_id()),
+        "user_id": g.user_oid,
         "created_at": utc_time
     })
     flash(f"Checked in!", "success")
@@ -612,7 +796,7 @@ def settings():
 @app.route("/my_reviews")
 @login_required
 def my_reviews():
-    user_id = ObjectId(current_user.get_id())
+    user_id = g.user_oid
 
     # Fetch all reviews by this user, sorted newest first
     reviews = list(reviews_col.find({"user_id": user_id}).sort("created_at", -1))
@@ -621,7 +805,6 @@ def my_reviews():
     for r in reviews:
         # Convert ObjectIds to strings for template
         r["_id_str"] = str(r["_id"])
-        r["user_id_str"] = str(r["user_id"])
 
         # Add cafe name for display
         cafe = cafes_col.find_one({"_id": r["cafe_id"]})
@@ -634,22 +817,27 @@ def my_reviews():
     return render_template(
         "my-reviews.html",
         reviews=reviews,
-        current_user_id=str(user_id)
+        current_user_id=g.user_id_str
     )
 
 @app.route("/profile", methods=["GET", "POST"])
 @login_required
 def profile():
     # get the user doc
-    user_data = users_col.find_one({"_id": ObjectId(current_user.get_id())})
+    user_data = users_col.find_one({"_id": g.user_oid})
     op_hours = user_data.get('operation_hours')
     if not isinstance(op_hours, dict):
         op_hours = {} # make operation hours dict if it was str before
 
     if request.method == "POST":
-        username = request.form.get("username")
+        username = (request.form.get("username") or "").strip()
         phone = request.form.get("phone")
-        
+
+        # usernames are unique, so an empty one isn't allowed either
+        if not username:
+            flash("Username is required.", "error")
+            return redirect(url_for('profile'))
+
         # update username and phone
         update_fields = {
             "username": username,
@@ -667,47 +855,53 @@ def profile():
             amenities_list = [item.strip() for item in amenities_raw.split(",") if item.strip()]
             popular_list = [item.strip() for item in popular_raw.split(",") if item.strip()]
 
+            cafe_name = request.form.get("cafe_name")
             cafe_update = {
-                "name": request.form.get("cafe_name"),
+                "name": cafe_name,
+                "name_lower": (cafe_name or "").lower(),
                 "address": request.form.get("shop_location"),
+                "zip_code": zip_from_address(request.form.get("shop_location")),
                 "map_src": request.form.get("map_src"),
                 "hours": op_hours,
                 "amenities": amenities_list,
                 "popular": popular_list
             }
 
-            user_update = {
+            update_fields.update({
                 "cafe_name": request.form.get("cafe_name"),
                 "shop_location": request.form.get("shop_location"),
                 "map_src": request.form.get("map_src"),
                 "operation_hours": op_hours,
                 "amenities": amenities_list,
                 "popular": popular_list
-            }
-            # update database
+            })
+
+        # update the user first, so a taken username leaves the cafe untouched too
+        try:
             users_col.update_one(
-                {"_id": ObjectId(current_user.get_id())},
-                {"$set": user_update}
+                {"_id": g.user_oid},
+                {"$set": update_fields}
             )
+        except DuplicateKeyError:
+            flash("That username is already taken.", "error")
+            return redirect(url_for('profile'))
 
+        if current_user.role == 'owner':
             cafes_col.update_one(
-                {"owner_id": ObjectId(current_user.get_id())},
+                {"owner_id": g.user_oid},
                 {"$set": cafe_update}
             )
-        users_col.update_one(
-            {"_id": ObjectId(current_user.get_id())},
-            {"$set": update_fields}
-        )
         
+        session.pop("user_json", None)
         flash("Profile updated successfully!", "success")
         return redirect(url_for('settings')) 
-    return render_template("profile.html", op_hours=op_hours)
+    return render_template("profile.html", op_hours=op_hours, user_data=user_data)
 
 
 @app.route("/saved")
 @login_required
 def saved_places():
-    user_id = current_user.get_id()
+    user_id = g.user_id_str
     query = request.args.get("q", "").strip()
 
     db_filter = {"user_id": user_id}
@@ -724,17 +918,17 @@ def saved_places():
 @app.route("/saved/add/<cafe_id>", methods=["POST"])
 @login_required
 def save_cafe(cafe_id):
-    user_id = current_user.get_id()
+    user_id = g.user_id_str
 
     if saved_col.find_one({"user_id": user_id, "cafe_id": cafe_id}):
         flash("Cafe is already in your saved places.", "info")
-        return redirect(request.referrer or url_for("saved_places"))
+        return redirect(back_url(url_for("saved_places")))
 
-    try:
-        cafe = cafes_col.find_one({"_id": ObjectId(cafe_id)})
-    except Exception:
+    cafe_obj_id = to_object_id(cafe_id)
+    if not cafe_obj_id:
         flash("Invalid cafe.", "error")
-        return redirect(request.referrer or url_for("home"))
+        return redirect(back_url(url_for("home")))
+    cafe = cafes_col.find_one({"_id": cafe_obj_id})
 
     cafe_name    = cafe["name"]                 if cafe else "Unknown Cafe"
     neighborhood = cafe.get("neighborhood", "") if cafe else ""
@@ -748,18 +942,19 @@ def save_cafe(cafe_id):
         "neighborhood": neighborhood,
         "address":      address,
         "hours":        hours,
-        "saved_at":     datetime.datetime.utcnow(),
+        "saved_at":     utc_now(),
     })
 
     flash(f"{cafe_name} added to saved places!", "success")
-    return redirect(request.referrer or url_for("saved_places"))
+    return redirect(back_url(url_for("saved_places")))
 
 
 @app.route("/saved/remove/<place_id>", methods=["POST"])
 @login_required
 def unsave_cafe(place_id):
-    user_id = current_user.get_id()
-    result  = saved_col.delete_one({"_id": ObjectId(place_id), "user_id": user_id})
+    user_id = g.user_id_str
+    # a malformed id becomes None and simply matches nothing
+    result  = saved_col.delete_one({"_id": to_object_id(place_id), "user_id": user_id})
 
     flash(
         "Cafe removed from saved places." if result.deleted_count else "Could not remove that cafe.",
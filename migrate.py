@@ -0,0 +1,103 @@
+"""
+One-off data migrations for the Sips database.
+
+Run once after pulling changes that need existing documents rewritten:
+    python migrate.py
+Each step only touches documents that still need it, so re-running is safe.
+"""
+import os
+
+import pymongo
+from dotenv import load_dotenv
+from pymongo.errors import DuplicateKeyError
+
+load_dotenv()
+client = pymongo.MongoClient(os.getenv("MONGO_URI"))
+db = client[os.getenv("MONGO_DBNAME", "sips")]
+
+
+# search matches a prefix of the lowercased cafe name
+def backfill_cafe_name_lower():
+    result = db["cafes"].update_many(
+        {"name_lower": {"$exists": False}, "name": {"$type": "string"}},
+        [{"$set": {"name_lower": {"$toLower": "$name"}}}]
+    )
+    print(f"cafes: added name_lower to {result.modified_count} document(s)")
+
+
+
+# emails are stored trimmed and lowercased; accounts whose normalized email
+# already belongs to someone else are left alone and listed for manual cleanup
+def normalize_user_emails():
+    users = db["users"]
+    updated, collisions = 0, []
+    for user in users.find({"email": {"$regex": r"[A-Z]|^\s|\s$"}}, {"email": 1}):
+        email = user["email"].strip().lower()
+        if users.find_one({"email": email, "_id": {"$ne": user["_id"]}}, {"_id": 1}):
+            collisions.append(user)
+            continue
+        try:
+            users.update_one({"_id": user["_id"]}, {"$set": {"email": email}})
+        except DuplicateKeyError:
+            collisions.append(user)
+            continue
+        updated += 1
+
+    print(f"users: normalized {updated} email(s)")
+    for user in collisions:
+        print(f"  skipped {user['_id']} ({user['email']!r}): normalized email is already taken")
+
+
+
+# reviews carry their author id as a string, written once instead of converted on every read
+def backfill_review_user_id_str():
+    result = db["reviews"].update_many(
+        {"user_id_str": {"$exists": False}},
+        [{"$set": {"user_id_str": {"$toString": "$user_id"}}}]
+    )
+    print(f"reviews: added user_id_str to {result.modified_count} document(s)")
+
+
+
+# home sorts and groups cafes by zip code (same rule as zip_from_address in app.py)
+def backfill_cafe_zip_code():
+    cafes = db["cafes"]
+    updated = 0
+    for cafe in cafes.find({"zip_code": {"$exists": False}}, {"address": 1}):
+        parts = (cafe.get("address") or "").split()
+        cafes.update_one({"_id": cafe["_id"]}, {"$set": {"zip_code": parts[-1] if parts else "Other"}})
+        updated += 1
+    print(f"cafes: added zip_code to {updated} document(s)")
+
+
+# usernames get a unique index when the app starts, but profile edits used to allow
+# duplicate (or missing) names; every clashing account after the oldest is renamed
+# to "<name>-<end of its id>", and its reviews pick up the new name
+def dedupe_usernames():
+    users = db["users"]
+    renamed = 0
+    duplicates = users.aggregate([
+        {"$group": {"_id": "$username", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ])
+    for group in duplicates:
+        for user_id in sorted(group["ids"])[1:]:
+            new_name = f"{group['_id'] or 'user'}-{str(user_id)[-6:]}"
+            try:
+                users.update_one({"_id": user_id}, {"$set": {"username": new_name}})
+            except DuplicateKeyError:
+                print(f"  could not rename {user_id} ({group['_id']!r}): {new_name!r} is taken, fix it by hand")
+                continue
+            db["reviews"].update_many({"user_id": user_id}, {"$set": {"username": new_name}})
+            print(f"  renamed {user_id}: {group['_id']!r} -> {new_name!r}")
+            renamed += 1
+
+    print(f"users: renamed {renamed} duplicate username(s)")
+
+
+if __name__ == "__main__":
+    dedupe_usernames()
+    backfill_cafe_name_lower()
+    backfill_cafe_zip_code()
+    normalize_user_emails()
+    backfill_review_user_id_str()